@@ -0,0 +1,85 @@
+/*
+ * Embedding Kernels Template
+ * Usage: Optional native kernels for embedding-utils.py (loaded via ctypes)
+ *
+ * Plain scalar loops written so the compiler can auto-vectorize them.
+ * Build next to embedding-utils.py; the Python side falls back to NumPy
+ * when the shared library is missing or the CPU lacks the target features.
+ * The x86_64 feature check reads /proc/cpuinfo, so on Intel macOS the
+ * library is never loaded and the NumPy path is always used.
+ *
+ *   # Linux x86_64 (AVX2 + FMA, 256-bit lanes)
+ *   cc -O3 -march=haswell -mavx2 -mfma -ffast-math -shared -fPIC \
+ *      -o libembedding_kernels.so embedding-kernels.c -lm
+ *
+ *   # Linux aarch64 (NEON, baseline ARMv8.0 so every aarch64 CPU can load it)
+ *   cc -O3 -march=armv8-a -ffast-math -shared -fPIC \
+ *      -o libembedding_kernels.so embedding-kernels.c -lm
+ *
+ *   # macOS (Apple Silicon)
+ *   cc -O3 -ffast-math -shared -fPIC \
+ *      -o libembedding_kernels.dylib embedding-kernels.c -lm
+ */
+
+#include <math.h>
+#include <stddef.h>
+
+// ===========================================
+// Similarity
+// ===========================================
+
+/* Cosine similarity of two d-dim vectors (single fused pass) */
+float cosine(const float *a, const float *b, size_t d) {
+    float dot = 0.0f, na = 0.0f, nb = 0.0f;
+    for (size_t i = 0; i < d; i++) {
+        dot += a[i] * b[i];
+        na += a[i] * a[i];
+        nb += b[i] * b[i];
+    }
+    if (na == 0.0f || nb == 0.0f) {
+        return 0.0f;
+    }
+    return dot / sqrtf(na * nb);
+}
+
+/* Cosine similarity of query q against every row of an (n, d) matrix */
+void cosine_matrix(const float *m, const float *q, float *out, size_t n, size_t d) {
+    float qq = 0.0f;
+    for (size_t j = 0; j < d; j++) {
+        qq += q[j] * q[j];
+    }
+    float q_norm = sqrtf(qq);
+
+    for (size_t i = 0; i < n; i++) {
+        const float *row = m + i * d;
+        float dot = 0.0f, rr = 0.0f;
+        for (size_t j = 0; j < d; j++) {
+            dot += row[j] * q[j];
+            rr += row[j] * row[j];
+        }
+        float denom = sqrtf(rr) * q_norm;
+        out[i] = denom > 0.0f ? dot / denom : 0.0f;
+    }
+}
+
+// ===========================================
+// Normalization
+// ===========================================
+
+/* L2-normalize an (n, d) matrix in place, writing the original row norms */
+void normalize(float *m, float *norms, size_t n, size_t d) {
+    for (size_t i = 0; i < n; i++) {
+        float *row = m + i * d;
+        float ss = 0.0f;
+        for (size_t j = 0; j < d; j++) {
+            ss += row[j] * row[j];
+        }
+        float norm = sqrtf(ss);
+        norms[i] = norm;
+
+        float inv = 1.0f / (norm > 1e-10f ? norm : 1e-10f);
+        for (size_t j = 0; j < d; j++) {
+            row[j] *= inv;
+        }
+    }
+}
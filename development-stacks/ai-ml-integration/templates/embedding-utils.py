@@ -3,11 +3,101 @@ Embedding Utilities Template
 Usage: Generate and manage embeddings for RAG, search, and similarity
 """
 
+import ctypes
+import atexit
+import hashlib
+import json
+import math
+import mmap
 import os
-from typing import List, Optional, Union
-from dataclasses import dataclass
+import platform
+import re
+import sys
+import weakref
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
 import numpy as np
 
+try:
+    import simsimd  # Optional: SIMD similarity kernels (pip install simsimd)
+    _HAS_SIMSIMD = True
+except ImportError:
+    simsimd = None
+    _HAS_SIMSIMD = False
+
+try:
+    import faiss  # Optional: ANN index for large corpora (pip install faiss-cpu)
+    _HAS_FAISS = True
+except ImportError:
+    faiss = None
+    _HAS_FAISS = False
+
+try:
+    from numba import njit  # Optional: fused JIT kernels (pip install numba)
+    _HAS_NUMBA = True
+except ImportError:
+    njit = None
+    _HAS_NUMBA = False
+
+
+# ===========================================
+# Native Kernels (optional, see embedding-kernels.c)
+# ===========================================
+
+def _cpu_supports_kernels() -> bool:
+    """Check once that this CPU can run the -march flags used to build the kernels"""
+    machine = platform.machine().lower()
+    if machine in ("arm64", "aarch64"):
+        return True  # Built with plain -march=armv8-a (NEON is baseline)
+    if machine not in ("x86_64", "amd64"):
+        return False
+
+    # Built with -march=haswell: running without AVX2/FMA would SIGILL.
+    # Only Linux exposes /proc/cpuinfo, so Intel macOS never loads the kernels
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line for line in f if line.startswith("flags")), "").split()
+    except OSError:
+        return False
+    return "avx2" in flags and "fma" in flags
+
+
+def _load_kernels() -> Optional[ctypes.CDLL]:
+    """Load the optional native kernels built from embedding-kernels.c"""
+    suffix = ".dylib" if sys.platform == "darwin" else ".so"
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libembedding_kernels" + suffix)
+    if not os.path.exists(path) or not _cpu_supports_kernels():
+        return None
+
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+
+    f32p = ctypes.POINTER(ctypes.c_float)
+    size = ctypes.c_size_t
+    lib.cosine.argtypes = [f32p, f32p, size]
+    lib.cosine.restype = ctypes.c_float
+    lib.cosine_matrix.argtypes = [f32p, f32p, f32p, size, size]
+    lib.cosine_matrix.restype = None
+    lib.normalize.argtypes = [f32p, f32p, size, size]
+    lib.normalize.restype = None
+    return lib
+
+
+_KERNELS = _load_kernels()
+
+
+def _f32_ptr(arr: np.ndarray):
+    return arr.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+
+
 # ===========================================
 # Configuration
 # ===========================================
@@ -20,6 +110,8 @@ class EmbeddingConfig:
     dimensions: int = 1536
     batch_size: int = 100
     normalize: bool = True
+    workers: int = 1  # >1: process pool for local models, threads for remote APIs
+    storage_dtype: str = "float32"  # float32, float16, int8
 
 
 # Provider-specific models
@@ -50,6 +142,8 @@ def get_config_from_env() -> EmbeddingConfig:
         dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", model_info.get("dimensions", 1536))),
         batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
         normalize=os.getenv("EMBEDDING_NORMALIZE", "true").lower() == "true",
+        workers=int(os.getenv("EMBEDDING_WORKERS", "1")),
+        storage_dtype=os.getenv("EMBEDDING_STORAGE_DTYPE", "float32"),
     )
 
 
@@ -62,52 +156,371 @@ class EmbeddingClient:
 
     def __init__(self, config: Optional[EmbeddingConfig] = None):
         self.config = config or get_config_from_env()
+        self._pool: Optional[Executor] = None
 
-    def embed(self, texts: Union[str, List[str]]) -> np.ndarray:
-        """Generate embeddings for texts"""
+        if self.config.storage_dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported storage_dtype: {self.config.storage_dtype}")
+
+    def embed(
+        self,
+        texts: Union[str, List[str]],
+        quantize: Optional[bool] = None,
+    ) -> Union[np.ndarray, "NormalizedEmbeddings", "Int8Matrix"]:
+        """Generate embeddings for texts (normalized once here, at ingest)
+
+        quantize=None follows storage_dtype; pass quantize=False for query
+        embeddings so an int8-configured client still returns float vectors.
+        """
         if isinstance(texts, str):
             texts = [texts]
 
-        # Process in batches
-        all_embeddings = []
-        for i in range(0, len(texts), self.config.batch_size):
-            batch = texts[i:i + self.config.batch_size]
-            embeddings = self._embed_batch(batch)
-            all_embeddings.extend(embeddings)
-
-        result = np.array(all_embeddings)
+        # Process in batches, writing straight into a preallocated matrix
+        result = np.empty((len(texts), self.config.dimensions), dtype=np.float32)
+        starts = range(0, len(texts), self.config.batch_size)
+        batches = [texts[i:i + self.config.batch_size] for i in starts]
+        for i, batch, vectors in zip(starts, batches, self._map_batches(batches)):
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if vectors.shape != (len(batch), self.config.dimensions):
+                raise ValueError(
+                    f"Model returned embeddings of shape {vectors.shape}, expected "
+                    f"({len(batch)}, {self.config.dimensions}); set EmbeddingConfig.dimensions "
+                    f"(or EMBEDDING_DIMENSIONS) to match model {self.config.model!r}"
+                )
+            result[i:i + len(batch)] = vectors
 
         if self.config.normalize:
             result = self._normalize(result)
 
+        return self._to_storage(result, quantize)
+
+    def embed_iter(self, texts: Iterable[str]) -> Iterator[Union[np.ndarray, "Int8Matrix"]]:
+        """Embed a lazy stream of texts, yielding one batch at a time (O(batch_size * d) memory)
+
+        Batches are cast to storage_dtype like embed(), but run serially:
+        the workers setting does not apply here.
+        """
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, self.config.batch_size))
+            if not batch:
+                return
+
+            vectors = np.array(self._embed_batch(batch), dtype=np.float32)
+            if self.config.normalize:
+                vectors = self._normalize(vectors).values
+            yield self._to_storage(vectors)
+
+    def _to_storage(
+        self,
+        result: Union[np.ndarray, "NormalizedEmbeddings"],
+        quantize: Optional[bool] = None,
+    ) -> Union[np.ndarray, "NormalizedEmbeddings", "Int8Matrix"]:
+        """Cast embeddings to config.storage_dtype (an explicit quantize wins)"""
+        if quantize is None:
+            quantize = self.config.storage_dtype == "int8"
+        if quantize:
+            return Int8Matrix.from_float(np.asarray(result))
+
+        if self.config.storage_dtype == "float16":
+            # Half the bytes to stream through similarity search
+            if isinstance(result, NormalizedEmbeddings):
+                result.values = result.values.astype(np.float16)
+            else:
+                result = result.astype(np.float16)
+
         return result
 
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Override in subclass"""
+    def close(self) -> None:
+        """Shut down the worker pool, if one was started"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _map_batches(self, batches: List[List[str]]) -> Iterable[np.ndarray]:
+        """Embed batches in order, concurrently when workers > 1"""
+        if self.config.workers <= 1 or len(batches) <= 1:
+            return map(self._embed_batch, batches)
+
+        if self._pool is None:
+            if self.config.provider == "local":
+                # CPU-bound inference: one process, each with its own model copy
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.config.workers,
+                    initializer=_init_embed_worker,
+                    initargs=(type(self), self.config),
+                )
+            else:
+                # Remote APIs are bound by network round trips, not the GIL
+                self._pool = ThreadPoolExecutor(max_workers=self.config.workers)
+
+        if isinstance(self._pool, ProcessPoolExecutor):
+            return self._pool.map(_embed_batch_worker, batches)
+        return self._pool.map(self._embed_batch, batches)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Override in subclass: return float32 array of shape (len(texts), dimensions)"""
         raise NotImplementedError("Implement _embed_batch() for your provider")
 
-    def _normalize(self, embeddings: np.ndarray) -> np.ndarray:
-        """L2 normalize embeddings"""
-        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-        return embeddings / np.maximum(norms, 1e-10)
+    def _normalize(self, embeddings: np.ndarray) -> "NormalizedEmbeddings":
+        """L2 normalize embeddings in place, keeping the original norms"""
+        if (_KERNELS is not None and embeddings.dtype == np.float32
+                and embeddings.flags.c_contiguous and embeddings.flags.writeable):
+            n, d = embeddings.shape
+            norms = np.empty(n, dtype=np.float32)
+            _KERNELS.normalize(_f32_ptr(embeddings), _f32_ptr(norms), n, d)
+            return NormalizedEmbeddings(values=embeddings, norms=norms)
+
+        # Squared row norms in one pass without materializing embeddings**2
+        norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+        embeddings *= (1.0 / np.maximum(norms, 1e-10))[:, None]
+        return NormalizedEmbeddings(values=embeddings, norms=norms)
+
+
+# Per-process client for local-model worker pools (the subclass must be
+# importable at module level so it can be pickled into the workers)
+_worker_client: Optional[EmbeddingClient] = None
+
+
+def _init_embed_worker(client_cls: type, config: EmbeddingConfig) -> None:
+    """Pool initializer: build one client (and load its model) per worker"""
+    global _worker_client
+    _worker_client = client_cls(replace(config, workers=1))
+
+
+def _embed_batch_worker(texts: List[str]) -> np.ndarray:
+    """Embed one batch inside a worker process"""
+    return np.asarray(_worker_client._embed_batch(texts), dtype=np.float32)
+
+
+# ===========================================
+# Normalized Embeddings
+# ===========================================
+
+@dataclass
+class NormalizedEmbeddings:
+    """L2-normalized embedding matrix with the original row norms"""
+    values: np.ndarray  # float32 (or float16 with storage_dtype), shape (n, d), unit rows
+    norms: np.ndarray   # float32, shape (n,)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        return self.values[idx]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is not None and np.dtype(dtype) != self.values.dtype:
+            if copy is False:
+                raise ValueError("Converting NormalizedEmbeddings to another dtype requires a copy")
+            return self.values.astype(dtype)
+        return self.values.copy() if copy else self.values
+
+
+# ===========================================
+# Int8 Quantization
+# ===========================================
+
+def quantize_int8(vec: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetric int8 quantization: vec ≈ codes * scale"""
+    vec = np.asarray(vec, dtype=np.float32)
+    scale = float(np.max(np.abs(vec))) / 127.0 if vec.size else 0.0
+    if scale == 0.0:
+        return np.zeros(vec.shape, dtype=np.int8), 1.0
+
+    codes = np.round(vec / scale).astype(np.int8)
+    return codes, scale
+
+
+@dataclass
+class Int8Matrix:
+    """Int8 embedding matrix with one symmetric scale per row (4x smaller than fp32)"""
+    codes: np.ndarray   # int8, shape (n, d)
+    scales: np.ndarray  # float32, shape (n,)
+    norms: Optional[np.ndarray] = None  # float32 L2 norm of each code row, shape (n,)
+
+    def __post_init__(self):
+        if self.norms is None:
+            # Once per matrix, so per-query cosine never re-reduces the corpus
+            self.norms = np.sqrt(
+                np.einsum("nd,nd->n", self.codes, self.codes, dtype=np.int32)
+            ).astype(np.float32)
+
+    @classmethod
+    def from_float(cls, embeddings: np.ndarray) -> "Int8Matrix":
+        """Quantize a float matrix row by row"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        scales = np.max(np.abs(embeddings), axis=1) / 127.0
+        scales[scales == 0.0] = 1.0
+        codes = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return cls(codes=np.ascontiguousarray(codes), scales=scales.astype(np.float32))
+
+    def dequantize(self) -> np.ndarray:
+        """Reconstruct approximate float32 embeddings"""
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+    def __array__(self, dtype=None, copy=None):
+        """Dense (dequantized) view, so Int8Matrix works wherever arrays do"""
+        if copy is False:
+            raise ValueError("Dequantizing an Int8Matrix always requires a copy")
+        dense = self.dequantize()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def __getitem__(self, idx) -> np.ndarray:
+        """Dequantized row(s), so client.embed(text)[0] works for int8 storage"""
+        codes = self.codes[idx].astype(np.float32)
+        scales = self.scales[idx]
+        return codes * (scales[:, None] if codes.ndim == 2 else scales)
+
+    def __len__(self) -> int:
+        return len(self.codes)
 
 
 # ===========================================
 # Similarity Functions
 # ===========================================
 
+if _HAS_NUMBA:
+    # No cache=True: the on-disk cache is keyed by module name and breaks when
+    # the template is imported under another name; one eager signature is cheap
+    @njit("f4(f4[::1], f4[::1])", fastmath=True)
+    def _cosine_f32(a, b):
+        """Fused single-pass dot + norms (auto-vectorized by LLVM)"""
+        dot = np.float32(0.0)
+        na = np.float32(0.0)
+        nb = np.float32(0.0)
+        for i in range(a.shape[0]):
+            dot += a[i] * b[i]
+            na += a[i] * a[i]
+            nb += b[i] * b[i]
+        if na == 0.0 or nb == 0.0:
+            return np.float32(0.0)
+        return dot / math.sqrt(na * nb)
+
+
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     """Compute cosine similarity between two vectors"""
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    a = np.ascontiguousarray(a, dtype=np.float32)
+    b = np.ascontiguousarray(b, dtype=np.float32)
+    if a.shape != b.shape:
+        # The fused kernels loop over len(a) and would read past the end of b
+        raise ValueError(f"Shape mismatch: {a.shape} vs {b.shape}")
 
+    if _HAS_NUMBA:
+        return float(_cosine_f32(a, b))
+
+    if _KERNELS is not None:
+        return float(_KERNELS.cosine(_f32_ptr(a), _f32_ptr(b), len(a)))
+
+    # vdot on contiguous 1-D float32 skips the generic dot/norm dispatch
+    denom = math.sqrt(np.vdot(a, a) * np.vdot(b, b))
+    return float(np.vdot(a, b) / denom) if denom > 0 else 0.0
+
+
+def cosine_with_norm(a: np.ndarray, b: np.ndarray, b_norm: float) -> float:
+    """Cosine similarity when the norm of b is already known"""
+    denom = np.linalg.norm(a) * b_norm
+    return float(np.dot(a, b) / denom) if denom > 0 else 0.0
 
-def cosine_similarity_matrix(embeddings: np.ndarray, query: np.ndarray) -> np.ndarray:
-    """Compute cosine similarity between query and all embeddings"""
-    # Normalize
-    embeddings_norm = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-    query_norm = query / np.linalg.norm(query)
 
-    return np.dot(embeddings_norm, query_norm)
+def cosine_similarity_matrix(
+    embeddings: Union[np.ndarray, NormalizedEmbeddings],
+    query: np.ndarray,
+) -> np.ndarray:
+    """Compute cosine similarity between query and all embeddings"""
+    if isinstance(embeddings, NormalizedEmbeddings):
+        # Corpus is unit-norm already: similarity is a single matvec
+        query = np.asarray(query, dtype=np.float32)
+        q_unit = query / max(np.linalg.norm(query), 1e-10)
+        values = embeddings.values
+
+        if values.dtype == np.float16:
+            # Keep the corpus in half precision; only the query is cast
+            q_half = np.ascontiguousarray(q_unit, dtype=np.float16)
+            if _HAS_SIMSIMD:
+                scores = simsimd.cdist(q_half[None, :], values, metric="inner")
+                return np.asarray(scores, dtype=np.float32).ravel()
+            return np.einsum("d,nd->n", q_half, values).astype(np.float32)
+
+        return values @ q_unit
+
+    # C-contiguous float32 lets SimSIMD read the buffers without copying
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    query = np.ascontiguousarray(query, dtype=np.float32)
+
+    if _HAS_SIMSIMD:
+        # Norms are computed on the fly, no normalized copy of the corpus
+        distances = simsimd.cdist(query[None, :], embeddings, metric="cosine")
+        return 1.0 - np.asarray(distances).ravel()
+
+    if _KERNELS is not None and embeddings.ndim == 2 and query.shape == embeddings.shape[1:]:
+        n, d = embeddings.shape
+        out = np.empty(n, dtype=np.float32)
+        _KERNELS.cosine_matrix(_f32_ptr(embeddings), _f32_ptr(query), _f32_ptr(out), n, d)
+        return out
+
+    # NumPy fallback: divide the scores instead of normalizing the corpus;
+    # einsum reduces each row in place (linalg.norm would square into an N x d temp)
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings)) * np.sqrt(query @ query)
+    return np.dot(embeddings, query) / np.maximum(norms, 1e-10)
+
+
+def cosine_similarity_matrix_i8(matrix: Int8Matrix, query: np.ndarray) -> np.ndarray:
+    """Compute cosine similarity between query and int8-quantized embeddings"""
+    q_codes, _ = quantize_int8(query)
+    q_codes = np.ascontiguousarray(q_codes)
+
+    # Per-row scales cancel out in cosine, so it reduces to the integer codes
+    if _HAS_SIMSIMD:
+        distances = simsimd.cdist(q_codes[None, :], matrix.codes, metric="cosine")
+        return 1.0 - np.asarray(distances).ravel()
+
+    # Accumulate in int32 (d * 127² overflows int16); einsum casts in buffered
+    # chunks, so the corpus is never widened to a full int32 copy
+    dots = np.einsum("nd,d->n", matrix.codes, q_codes, dtype=np.int32)
+    q_norm = np.sqrt(np.einsum("d,d->", q_codes, q_codes, dtype=np.int32))
+    return dots / np.maximum(matrix.norms * q_norm, 1e-10)
+
+
+def sign_hash(embeddings: np.ndarray) -> np.ndarray:
+    """Pack the sign bit of every dimension into a binary hash (d=1536 -> 192 B)"""
+    embeddings = np.atleast_2d(np.asarray(embeddings))
+    return np.packbits(embeddings > 0, axis=1)
+
+
+def hamming_distances(hashes: np.ndarray, query_hash: np.ndarray) -> np.ndarray:
+    """Hamming distance between one packed hash and each row of hashes"""
+    return hamming_distance_matrix(np.atleast_2d(query_hash), hashes)[0]
+
+
+def hamming_distance_matrix(hashes_a: np.ndarray, hashes_b: np.ndarray) -> np.ndarray:
+    """Pairwise Hamming distances between two sets of packed hashes, shape (n_a, n_b)"""
+    hashes_a = np.ascontiguousarray(hashes_a, dtype=np.uint8)
+    hashes_b = np.ascontiguousarray(hashes_b, dtype=np.uint8)
+
+    if _HAS_SIMSIMD:
+        # XOR + POPCNT kernels on packed bitvectors
+        distances = simsimd.cdist(hashes_a, hashes_b, metric="hamming", dtype="bin8")
+        return np.asarray(distances).reshape(len(hashes_a), len(hashes_b))
+
+    if hashes_a.shape[1] % 8 == 0:
+        # XOR and count whole 64-bit words: 8x fewer elements than bytes
+        xor = hashes_a.view(np.uint64)[:, None, :] ^ hashes_b.view(np.uint64)[None, :, :]
+        if hasattr(np, "bitwise_count"):  # NumPy >= 2.0: hardware POPCNT ufunc
+            return np.bitwise_count(xor).sum(axis=2, dtype=np.int64)
+        return _popcount64(xor).sum(axis=2, dtype=np.int64)
+
+    xor = hashes_a[:, None, :] ^ hashes_b[None, :, :]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).sum(axis=2, dtype=np.int64)
+    return np.unpackbits(xor, axis=2).sum(axis=2, dtype=np.int64)
+
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """SWAR popcount of each uint64 word (bithack, no per-bit unpacking)"""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
 
 
 def euclidean_distance(a: np.ndarray, b: np.ndarray) -> float:
@@ -133,27 +546,91 @@ class SearchResult:
     metadata: Optional[dict] = None
 
 
+# Below this size a linear scan beats HNSW graph traversal
+ANN_MIN_CORPUS_SIZE = 10_000
+
+
+class ANNIndex:
+    """HNSW approximate nearest-neighbor index (FAISS) for large corpora"""
+
+    def __init__(
+        self,
+        dimensions: int,
+        m: int = 32,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+    ):
+        if not _HAS_FAISS:
+            raise ImportError("ANNIndex requires faiss: pip install faiss-cpu")
+
+        # Inner product on L2-normalized vectors == cosine similarity
+        self.index = faiss.IndexHNSWFlat(dimensions, m, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = ef_construction
+        self.index.hnsw.efSearch = ef_search
+
+    def build(self, embeddings: np.ndarray) -> "ANNIndex":
+        """Add embeddings to the index (normalized first)"""
+        # Explicit copy: normalize_L2 works in place and must not touch the caller's matrix
+        vectors = np.array(np.asarray(embeddings), dtype=np.float32, order="C", copy=True)
+        faiss.normalize_L2(vectors)
+        self.index.add(vectors)
+        return self
+
+    def search(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, indices) of the approximate top-k neighbors"""
+        q = np.array(query, dtype=np.float32, order="C").reshape(1, -1)
+        faiss.normalize_L2(q)
+        scores, indices = self.index.search(q, top_k)
+        return scores[0], indices[0]
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+
 def search_similar(
     query_embedding: np.ndarray,
-    embeddings: np.ndarray,
+    embeddings: Union[np.ndarray, NormalizedEmbeddings, Int8Matrix],
     texts: Optional[List[str]] = None,
     top_k: int = 5,
     threshold: float = 0.0,
+    ann: Optional[ANNIndex] = None,
 ) -> List[SearchResult]:
-    """Find most similar embeddings to query"""
+    """Find most similar embeddings to query (via ann index for large corpora)"""
+
+    if ann is not None and len(ann) >= ANN_MIN_CORPUS_SIZE and top_k > 0:
+        scores, indices = ann.search(query_embedding, top_k)
+        return [
+            SearchResult(
+                index=int(idx),
+                score=float(score),
+                text=texts[idx] if texts else None,
+            )
+            for score, idx in zip(scores, indices)
+            if idx >= 0 and score >= threshold  # FAISS pads missing hits with -1
+        ]
 
     # Compute similarities
-    similarities = cosine_similarity_matrix(embeddings, query_embedding)
-
-    # Get top-k indices
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    if isinstance(embeddings, Int8Matrix):
+        similarities = cosine_similarity_matrix_i8(embeddings, query_embedding)
+    else:
+        similarities = cosine_similarity_matrix(embeddings, query_embedding)
+
+    # Drop candidates below threshold before selecting
+    candidates = np.nonzero(similarities >= threshold)[0]
+    if top_k <= 0 or len(candidates) == 0:
+        return []
+
+    # O(N) partial selection, then sort only the top-k winners
+    scores = similarities[candidates]
+    if top_k < len(candidates):
+        part = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        part = np.arange(len(candidates))
+    top_indices = candidates[part[np.argsort(-scores[part], kind="stable")]]
 
     results = []
     for idx in top_indices:
         score = float(similarities[idx])
-        if score < threshold:
-            continue
-
         results.append(SearchResult(
             index=int(idx),
             score=score,
@@ -164,103 +641,228 @@ def search_similar(
 
 
 def deduplicate_by_similarity(
-    embeddings: np.ndarray,
+    embeddings: Union[np.ndarray, NormalizedEmbeddings, Int8Matrix],
     threshold: float = 0.95,
+    block_size: int = 1024,
+    hash_prefilter: bool = False,
+    hamming_slack: float = 2.0,
+    ann: bool = False,
 ) -> List[int]:
-    """Remove near-duplicate embeddings, return unique indices"""
-
-    n = len(embeddings)
-    unique_indices = []
+    """Remove near-duplicate embeddings, return unique indices
+
+    ann=True (requires faiss) checks each block against an HNSW index of the
+    rows kept so far instead of an exact GEMM, once N >= ANN_MIN_CORPUS_SIZE:
+    O(N log N) instead of O(N^2), but approximate (HNSW recall < 100%).
+
+    hash_prefilter=True skips exact cosine for pairs whose sign hashes differ
+    by more than hamming_slack times the expected Hamming distance. It is
+    approximate: the bound only holds with high probability, so it may miss
+    duplicates (more likely at low d or low threshold). It only runs when
+    SimSIMD is installed: NumPy popcount tiles are slower than the exact
+    BLAS path, which is used instead.
+    """
+
+    if isinstance(embeddings, Int8Matrix):
+        embeddings = embeddings.dequantize()
+
+    # Normalize once so every similarity below is a plain matmul
+    if isinstance(embeddings, NormalizedEmbeddings):
+        norm_emb = np.asarray(embeddings.values, dtype=np.float32)
+    else:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norm_emb = embeddings / np.maximum(norms, 1e-10)
+
+    if hash_prefilter and _HAS_SIMSIMD:
+        return _deduplicate_with_hashes(norm_emb, threshold, hamming_slack, block_size)
+
+    n = len(norm_emb)
+    unique_indices: List[int] = []
+
+    # HNSW index over the kept rows (M=32, efSearch=64) for very large N
+    kept_index = ANNIndex(norm_emb.shape[1]).index if ann and n >= ANN_MIN_CORPUS_SIZE else None
+
+    # Row blocks keep the similarity tile cache-resident
+    for start in range(0, n, block_size):
+        block = np.ascontiguousarray(norm_emb[start:start + block_size])
+
+        # Compare against everything kept in earlier blocks: nearest kept
+        # neighbor from the index, or one exact GEMM
+        if not unique_indices:
+            is_duplicate = np.zeros(len(block), dtype=bool)
+        elif kept_index is not None:
+            scores, _ = kept_index.search(block, 1)
+            is_duplicate = scores[:, 0] >= threshold
+        else:
+            prior = block @ norm_emb[unique_indices].T
+            is_duplicate = np.any(prior >= threshold, axis=1)
+
+        # Greedy sweep within the block, in input order
+        local = block @ block.T
+        kept_local = []
+        for i in range(len(block)):
+            if is_duplicate[i]:
+                continue
+            kept_local.append(i)
+            is_duplicate[i + 1:] |= local[i, i + 1:] >= threshold
+
+        unique_indices.extend(start + i for i in kept_local)
+        if kept_index is not None and kept_local:
+            kept_index.add(block[kept_local])
 
-    for i in range(n):
-        is_duplicate = False
-        for j in unique_indices:
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            if sim >= threshold:
-                is_duplicate = True
-                break
+    return unique_indices
 
-        if not is_duplicate:
-            unique_indices.append(i)
 
-    return unique_indices
+def _deduplicate_with_hashes(
+    norm_emb: np.ndarray,
+    threshold: float,
+    hamming_slack: float,
+    block_size: int,
+) -> List[int]:
+    """Approximate greedy dedup: fp32 cosine only on Hamming-close candidates"""
+    n, d = norm_emb.shape
+    hashes = sign_hash(norm_emb)
+    hash_bytes = hashes.shape[1]
+
+    # Sign bits disagree with probability ~angle/pi, so pairs far beyond the
+    # expected Hamming distance at the threshold angle are unlikely (but not
+    # guaranteed) to be duplicates; hamming_slack trades recall for speed
+    angle = math.acos(min(max(threshold, -1.0), 1.0))
+    max_hamming = d * angle / math.pi * hamming_slack
+
+    kept = np.empty(n, dtype=np.intp)
+    kept_hashes = np.empty_like(hashes)
+    count = 0
+
+    for start in range(0, n, block_size):
+        block = norm_emb[start:start + block_size]
+        block_hashes = hashes[start:start + block_size]
+        is_duplicate = np.zeros(len(block), dtype=bool)
+
+        # Hamming tiles against the kept set (~16 MB of XOR per tile), then
+        # exact cosine only for the close (block row, kept row) pairs
+        tile = max(1, (16 << 20) // (len(block) * hash_bytes))
+        for k in range(0, count, tile):
+            distances = hamming_distance_matrix(block_hashes, kept_hashes[k:min(k + tile, count)])
+            rows, cols = np.nonzero((distances <= max_hamming) & ~is_duplicate[:, None])
+            if len(rows):
+                sims = np.einsum("ij,ij->i", block[rows], norm_emb[kept[k + cols]])
+                is_duplicate[rows[sims >= threshold]] = True
+
+        # Greedy sweep within the block, in input order
+        local = block @ block.T
+        for i in range(len(block)):
+            if is_duplicate[i]:
+                continue
+            kept[count] = start + i
+            kept_hashes[count] = block_hashes[i]
+            count += 1
+            is_duplicate[i + 1:] |= local[i, i + 1:] >= threshold
+
+    return kept[:count].tolist()
 
 
 # ===========================================
 # Text Chunking
 # ===========================================
 
-def chunk_text(
+def iter_text_chunks(
     text: str,
     chunk_size: int = 500,
     overlap: int = 50,
     separator: str = "\n",
-) -> List[str]:
-    """Split text into overlapping chunks"""
+) -> Iterator[str]:
+    """Split text into overlapping chunks, yielding them lazily"""
 
     # Split by separator first
     paragraphs = text.split(separator)
 
-    chunks = []
-    current_chunk = []
-    current_size = 0
+    sep_size = len(separator)
+
+    current_chunk = deque()
+    current_size = 0  # Exact length of separator.join(current_chunk)
 
     for para in paragraphs:
         para_size = len(para)
 
-        if current_size + para_size > chunk_size and current_chunk:
-            # Save current chunk
-            chunks.append(separator.join(current_chunk))
-
-            # Keep overlap
-            overlap_text = separator.join(current_chunk)
-            if len(overlap_text) > overlap:
-                # Find a good break point for overlap
-                current_chunk = [current_chunk[-1]] if current_chunk else []
-                current_size = len(current_chunk[-1]) if current_chunk else 0
-            else:
-                current_chunk = []
+        if current_chunk and current_size + sep_size + para_size > chunk_size:
+            # Emit current chunk (the only place the string is materialized)
+            yield separator.join(current_chunk)
+
+            # Keep the last paragraph as the overlap, unless the chunk was no
+            # longer than overlap or the overlap would push the next chunk
+            # over the limit
+            keep_overlap = current_size > overlap
+            while len(current_chunk) > 1:
+                current_size -= len(current_chunk.popleft()) + sep_size
+            if not keep_overlap or current_size + sep_size + para_size > chunk_size:
+                current_chunk.clear()
                 current_size = 0
 
+        if current_chunk:
+            current_size += sep_size
         current_chunk.append(para)
         current_size += para_size
 
     # Don't forget the last chunk
     if current_chunk:
-        chunks.append(separator.join(current_chunk))
+        yield separator.join(current_chunk)
+
+
+def chunk_text(
+    text: str,
+    chunk_size: int = 500,
+    overlap: int = 50,
+    separator: str = "\n",
+) -> List[str]:
+    """Split text into overlapping chunks"""
+    return list(iter_text_chunks(text, chunk_size, overlap, separator))
 
-    return chunks
 
+_BOUNDARY_RE = re.compile(r"(?:[.!?]\s|\n)")
 
-def chunk_by_tokens(
+
+def iter_token_chunks(
     text: str,
     max_tokens: int = 500,
     overlap_tokens: int = 50,
-) -> List[str]:
-    """Split text by approximate token count (4 chars ≈ 1 token)"""
+) -> Iterator[str]:
+    """Split text by approximate token count (4 chars ≈ 1 token), yielding lazily"""
 
     chars_per_token = 4
     chunk_size = max_tokens * chars_per_token
     overlap = overlap_tokens * chars_per_token
 
-    chunks = []
+    # Find every sentence boundary once, then binary-search per chunk
+    bounds = [m.end() for m in _BOUNDARY_RE.finditer(text)]
+
     start = 0
 
     while start < len(text):
         end = start + chunk_size
 
-        # Try to break at sentence boundary
+        # Try to break at the last sentence boundary inside the window,
+        # but only if the next chunk still starts past this one's start
         if end < len(text):
-            for boundary in [". ", "! ", "? ", "\n"]:
-                last_boundary = text.rfind(boundary, start, end)
-                if last_boundary > start:
-                    end = last_boundary + len(boundary)
-                    break
+            idx = bisect_right(bounds, end) - 1
+            if idx >= 0 and bounds[idx] > start + overlap:
+                end = bounds[idx]
+
+        chunk = text[start:end].strip()
+        if chunk:  # Skip empty chunks
+            yield chunk
 
-        chunks.append(text[start:end].strip())
-        start = end - overlap
+        # Always advance, even when overlap >= the chunk just emitted
+        start = end - overlap if end - overlap > start else end
 
-    return [c for c in chunks if c]  # Remove empty chunks
+
+def chunk_by_tokens(
+    text: str,
+    max_tokens: int = 500,
+    overlap_tokens: int = 50,
+) -> List[str]:
+    """Split text by approximate token count (4 chars ≈ 1 token)"""
+    return list(iter_token_chunks(text, max_tokens, overlap_tokens))
 
 
 # ===========================================
@@ -268,24 +870,47 @@ def chunk_by_tokens(
 # ===========================================
 
 class EmbeddingCache:
-    """Simple in-memory cache for embeddings"""
+    """In-memory LRU cache for embeddings (float16 by default, or int8 codes + scale)"""
+
+    def __init__(self, max_size: int = 10000, storage_dtype: str = "float16"):
+        if storage_dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported storage_dtype: {storage_dtype}")
 
-    def __init__(self, max_size: int = 10000):
-        self.cache: dict = {}
+        self.cache: OrderedDict = OrderedDict()
         self.max_size = max_size
+        self.storage_dtype = storage_dtype
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        """Stable, collision-resistant key (hash() is randomized per process)"""
+        return hashlib.sha1(text.encode("utf-8")).digest()
 
     def get(self, text: str) -> Optional[np.ndarray]:
         """Get cached embedding"""
-        return self.cache.get(hash(text))
+        key = self._key(text)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        self.cache.move_to_end(key)
+        if self.storage_dtype == "int8":
+            codes, scale = entry
+            return codes.astype(np.float32) * scale
+        return entry.astype(np.float32)
 
     def set(self, text: str, embedding: np.ndarray) -> None:
         """Cache embedding"""
-        if len(self.cache) >= self.max_size:
-            # Simple eviction: remove first item
-            first_key = next(iter(self.cache))
-            del self.cache[first_key]
-
-        self.cache[hash(text)] = embedding
+        key = self._key(text)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        elif len(self.cache) >= self.max_size:
+            # Evict least recently used
+            self.cache.popitem(last=False)
+
+        if self.storage_dtype == "int8":
+            self.cache[key] = quantize_int8(embedding)
+        else:
+            self.cache[key] = np.asarray(embedding, dtype=self.storage_dtype)
 
     def get_or_compute(
         self,
@@ -297,9 +922,179 @@ class EmbeddingCache:
         if cached is not None:
             return cached
 
-        embedding = compute_fn(text)
-        self.set(text, embedding)
-        return embedding
+        # Return the stored copy so hits and misses round-trip identically
+        self.set(text, compute_fn(text))
+        return self.get(text)
+
+    def get_or_compute_many(
+        self,
+        texts: List[str],
+        compute_batch_fn: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """Get from cache, computing all misses in a single batch call"""
+        found = {}
+        misses = {}  # Ordered set: repeated texts are computed once
+
+        for text in texts:
+            if text in found or text in misses:
+                continue
+            cached = self.get(text)
+            if cached is not None:
+                found[text] = cached
+            else:
+                misses[text] = None
+
+        if misses:
+            miss_texts = list(misses)
+            vectors = np.asarray(compute_batch_fn(miss_texts), dtype=np.float32)
+            for text, vector in zip(miss_texts, vectors):
+                self.set(text, vector)
+                found[text] = self.get(text)
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[text] for text in texts])
+
+
+class PersistentEmbeddingCache(EmbeddingCache):
+    """LRU embedding cache backed by memory-mapped files (survives restarts)
+
+    Rows live in <path>/embeddings.bin, each with a header in <path>/rows.idx
+    holding the owning key's SHA-1 digest and a CRC32 of the row. set() flushes
+    the touched row's pages, then its header, before returning. The key -> row
+    table in <path>/keys.json is written every save_every sets, by flush() /
+    context-manager exit, and automatically at interpreter exit (atexit), so
+    callers don't have to flush; a hard crash loses at most the last
+    save_every - 1 table updates. keys.json is only an index: a row is served
+    only if its header matches the key and its data, so a stale table turns
+    into a cache miss, never a wrong embedding.
+    """
+
+    HEADER_BYTES = 24  # 20-byte SHA-1 digest + 4-byte CRC32 of the row
+
+    def __init__(
+        self,
+        path: str,
+        dimensions: int,
+        max_size: int = 10000,
+        storage_dtype: str = "float32",
+        save_every: int = 100,
+    ):
+        if storage_dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported storage_dtype for memmap: {storage_dtype}")
+        super().__init__(max_size=max_size, storage_dtype=storage_dtype)
+
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, "embeddings.bin")
+        self.header_path = os.path.join(path, "rows.idx")
+        self.keys_path = os.path.join(path, "keys.json")
+        self.save_every = save_every
+        self._unsaved_sets = 0
+
+        self._data_map, self.rows = self._open_mapping(self.data_path, storage_dtype, (max_size, dimensions))
+        self._header_map, self.headers = self._open_mapping(self.header_path, np.uint8, (max_size, self.HEADER_BYTES))
+
+        # cache maps key -> row index, in LRU order (oldest first)
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as f:
+                for hex_key, row in json.load(f):
+                    self.cache[bytes.fromhex(hex_key)] = row
+
+        used = set(self.cache.values())
+        self._free_rows = [row for row in reversed(range(max_size)) if row not in used]
+
+        # Persist the key table at exit without keeping the cache alive
+        atexit.register(_flush_if_alive, weakref.ref(self))
+
+    @staticmethod
+    def _open_mapping(path: str, dtype, shape: Tuple[int, int]) -> Tuple[mmap.mmap, np.ndarray]:
+        nbytes = shape[0] * shape[1] * np.dtype(dtype).itemsize
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(nbytes)
+        elif os.path.getsize(path) != nbytes:
+            raise ValueError(f"{path} does not match max_size/dimensions/storage_dtype")
+
+        with open(path, "r+b") as f:
+            mapping = mmap.mmap(f.fileno(), nbytes)
+        return mapping, np.frombuffer(mapping, dtype=dtype).reshape(shape)
+
+    @staticmethod
+    def _flush_row(mapping: mmap.mmap, array: np.ndarray, row: int) -> None:
+        """Flush only the pages holding one row (offset must be page-aligned)"""
+        row_bytes = array.strides[0]
+        start = row * row_bytes
+        page_start = start - start % mmap.ALLOCATIONGRANULARITY
+        mapping.flush(page_start, start + row_bytes - page_start)
+
+    def _header(self, key: bytes, row: int) -> np.ndarray:
+        crc = zlib.crc32(self.rows[row].tobytes())
+        return np.frombuffer(key + crc.to_bytes(4, "little"), dtype=np.uint8)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Get cached embedding (one row read from the memmap)"""
+        key = self._key(text)
+        row = self.cache.get(key)
+        if row is None:
+            return None
+
+        # Row was reused or torn since keys.json was written: treat as a miss
+        if not np.array_equal(self.headers[row], self._header(key, row)):
+            del self.cache[key]
+            self._free_rows.append(row)
+            return None
+
+        self.cache.move_to_end(key)
+        return np.array(self.rows[row], dtype=np.float32)
+
+    def set(self, text: str, embedding: np.ndarray) -> None:
+        """Cache embedding, overwriting the LRU victim's row when full"""
+        key = self._key(text)
+        if key in self.cache:
+            row = self.cache[key]
+            self.cache.move_to_end(key)
+        elif self._free_rows:
+            row = self._free_rows.pop()
+            self.cache[key] = row
+        else:
+            _, row = self.cache.popitem(last=False)
+            self.cache[key] = row
+
+        # Data reaches disk before the header that vouches for it
+        self.rows[row] = embedding
+        self._flush_row(self._data_map, self.rows, row)
+        self.headers[row] = self._header(key, row)
+        self._flush_row(self._header_map, self.headers, row)
+
+        self._unsaved_sets += 1
+        if self._unsaved_sets >= self.save_every:
+            self._save_keys()
+
+    def _save_keys(self) -> None:
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([[key.hex(), row] for key, row in self.cache.items()], f)
+        os.replace(tmp_path, self.keys_path)
+        self._unsaved_sets = 0
+
+    def flush(self) -> None:
+        """Write dirty rows and the key table to disk"""
+        self._data_map.flush()
+        self._header_map.flush()
+        self._save_keys()
+
+    def __enter__(self) -> "PersistentEmbeddingCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+
+def _flush_if_alive(cache_ref: "weakref.ref[PersistentEmbeddingCache]") -> None:
+    """atexit hook: persist a cache's key table if it is still alive"""
+    cache = cache_ref()
+    if cache is not None:
+        cache.flush()
 
 
 # ===========================================
@@ -312,6 +1107,7 @@ from embedding_utils import (
     get_config_from_env,
     search_similar,
     chunk_text,
+    iter_text_chunks,
 )
 
 # Initialize client
@@ -332,4 +1128,8 @@ for r in results:
 long_text = open("document.txt").read()
 chunks = chunk_text(long_text, chunk_size=500, overlap=50)
 chunk_embeddings = client.embed(chunks)
+
+# Stream chunks and embeddings without holding the whole corpus in memory
+for batch in client.embed_iter(iter_text_chunks(long_text, chunk_size=500)):
+    index.add(batch)  # e.g. a FAISS index or a memmapped array
 """